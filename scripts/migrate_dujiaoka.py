@@ -5,23 +5,37 @@
 从独角数卡的 MySQL 数据库读取商品、分类、卡密等数据，
 通过 AuraLogic API 导入到目标系统中。
 
-依赖安装: pip install pymysql requests rich
+依赖安装: pip install pymysql requests rich orjson
+可选依赖: pip install aiohttp  (并发迁移优惠码)
 """
 
-import json
 import sys
-import time
+import asyncio
 import argparse
+import hashlib
 import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+from itertools import islice
+from urllib.parse import quote_plus
 
+import orjson
 import pymysql
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from rich.console import Console
 from rich.table import Table
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn
 from rich.logging import RichHandler
 
+try:
+    import aiohttp
+except ImportError:  # 未安装时优惠码逐条同步迁移
+    aiohttp = None
+
 # ============================================================
 # 配置
 # ============================================================
@@ -46,6 +60,7 @@ class AuraLogicConfig:
     timeout: int = 30
     retry_count: int = 3
     retry_delay: float = 1.0
+    pool_maxsize: int = 32
 
 
 @dataclass
@@ -55,7 +70,10 @@ class MigrationOptions:
     migrate_carmis: bool = True       # 卡密 -> 虚拟库存
     migrate_coupons: bool = True      # 优惠码 -> 促销码
     dry_run: bool = False             # 仅预览，不实际写入
-    batch_size: int = 50              # 卡密批量导入大小
+    batch_size: int = 2000            # 卡密批量导入大小
+    max_import_body_bytes: int = 8 * 1024 * 1024  # 单次卡密导入请求体 (表单编码后) 的字节上限
+    workers: int = 4                  # 卡密/优惠码迁移并发数
+    server_bulk: bool = False         # 使用服务端批量迁移接口 (不支持时自动回退)
     skip_disabled: bool = False       # 跳过已禁用的商品/分类
     default_product_status: str = "draft"  # 导入后的商品状态
 
@@ -73,62 +91,85 @@ logging.basicConfig(
 log = logging.getLogger("migrate")
 
 
+def chunked(items, size: int, max_bytes: int = 0):
+    """将可迭代对象惰性切分为每批最多 size 条的列表，max_bytes > 0 时同时限制每批表单编码后的字节数"""
+    it = iter(items)
+    if max_bytes <= 0:
+        yield from iter(lambda: list(islice(it, size)), [])
+        return
+    batch: list[str] = []
+    batch_bytes = 0
+    for item in it:
+        # 导入接口以 x-www-form-urlencoded 提交，按编码后长度计算，换行符编码为 %0A
+        n = len(quote_plus(item)) + 3
+        if batch and batch_bytes + n > max_bytes:
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += n
+        if len(batch) >= size:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+
 # ============================================================
 # AuraLogic API 客户端
 # ============================================================
 
+# 需要重试的 HTTP 状态码
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
 class AuraLogicClient:
     """AuraLogic API 客户端，使用 API Key + Secret 认证"""
 
     def __init__(self, config: AuraLogicConfig):
         self.config = config
         self.base_url = config.base_url.rstrip("/")
+        # 不修改 session.headers，headers 随每次请求传入，使 session 可被多线程共享
         self.session = requests.Session()
-        self.session.headers.update({
+        # 重试与限流退避交给 urllib3 连接池处理，重试时复用 keep-alive 连接
+        retry = Retry(
+            # retry_count 表示总尝试次数 (含首次请求)，urllib3 的 total 只计重试次数
+            total=max(0, config.retry_count - 1),
+            backoff_factor=config.retry_delay,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=["GET", "POST"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=32, pool_maxsize=config.pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # 请求 headers 只构造一次，requests 合并 headers 时不会修改传入的 dict
+        self._api_base = f"{self.base_url}/api/admin"
+        self._form_headers = {
             "X-API-Key": config.api_key,
             "X-API-Secret": config.api_secret,
-            "Content-Type": "application/json",
-        })
-        self.session.timeout = config.timeout
-
-    def _request(self, method: str, path: str, headers_override: dict = None, **kwargs) -> dict:
-        url = f"{self.base_url}/api/admin{path}"
-        last_err = None
-        # 临时移除 headers 前先备份
-        saved_headers = {}
-        if headers_override:
-            for k, v in headers_override.items():
-                if v is None:
-                    saved_headers[k] = self.session.headers.pop(k, None)
-                else:
-                    kwargs.setdefault("headers", {})
-                    kwargs["headers"][k] = v
-        try:
-            for attempt in range(1, self.config.retry_count + 1):
-                try:
-                    resp = self.session.request(method, url, **kwargs)
-                    if resp.status_code == 429:
-                        wait = float(resp.headers.get("Retry-After", self.config.retry_delay * attempt))
-                        log.warning(f"Rate limited, waiting {wait}s (attempt {attempt})")
-                        time.sleep(wait)
-                        continue
-                    resp.raise_for_status()
-                    return resp.json() if resp.text else {}
-                except requests.exceptions.RequestException as e:
-                    last_err = e
-                    if attempt < self.config.retry_count:
-                        time.sleep(self.config.retry_delay * attempt)
-                        log.warning(f"Request failed, retrying ({attempt}/{self.config.retry_count}): {e}")
-            raise RuntimeError(f"API request failed after {self.config.retry_count} attempts: {last_err}")
-        finally:
-            # 恢复被移除的 session headers
-            for k, v in saved_headers.items():
-                if v is not None:
-                    self.session.headers[k] = v
+        }
+        self._json_headers = {**self._form_headers, "Content-Type": "application/json"}
+        # 高频接口预先拼好 URL
+        self._url_products = f"{self._api_base}/products"
+        self._url_import_tpl = self._api_base + "/virtual-inventories/{}/import"
+
+    def _send(self, method: str, url: str, headers: dict, **kwargs) -> dict:
+        kwargs.setdefault("timeout", self.config.timeout)
+        resp = self.session.request(method, url, headers=headers, **kwargs)
+        resp.raise_for_status()
+        return resp.json() if resp.text else {}
+
+    def _request(self, method: str, path: str, **kwargs) -> dict:
+        # JSON 请求体用 orjson 序列化，比 requests 内置的标准库 json 更快
+        if "json" in kwargs:
+            kwargs["data"] = orjson.dumps(kwargs.pop("json"))
+        return self._send(method, self._api_base + path, self._json_headers, **kwargs)
 
     # -- 商品 --
     def create_product(self, data: dict) -> dict:
-        return self._request("POST", "/products", json=data)
+        return self._send("POST", self._url_products, self._json_headers, data=orjson.dumps(data))
 
     def list_products(self, page: int = 1, page_size: int = 100) -> dict:
         return self._request("GET", "/products", params={"page": page, "page_size": page_size})
@@ -140,19 +181,22 @@ class AuraLogicClient:
     def import_virtual_stock(self, inventory_id: int, items: list[str]) -> dict:
         """通过 text 模式批量导入卡密，每行一条"""
         content = "\n".join(items)
-        # 导入接口是 multipart form，不是 JSON
-        return self._request(
+        # 导入接口是表单提交，不是 JSON，Content-Type 由 requests 自动设置
+        return self._send(
             "POST",
-            f"/virtual-inventories/{inventory_id}/import",
+            self._url_import_tpl.format(inventory_id),
+            self._form_headers,
             data={"import_type": "text", "content": content},
-            headers_override={"Content-Type": None},  # 让 requests 自动设置
         )
 
-    def create_virtual_stock_item(self, inventory_id: int, content: str, remark: str = "") -> dict:
-        """单条创建库存项（用于循环卡密等需要备注的场景）"""
+    def create_virtual_stock_item(self, inventory_id: int, content: str, remark: str = "",
+                                  reserved: bool = False) -> dict:
+        """单条创建库存项（用于循环卡密等需要备注的场景），reserved=True 时创建即为已预留"""
         data = {"content": content}
         if remark:
             data["remark"] = remark
+        if reserved:
+            data["initial_status"] = "reserved"
         return self._request("POST", f"/virtual-inventories/{inventory_id}/stocks", json=data)
 
     def reserve_stock_item(self, inventory_id: int, stock_id: int, remark: str = "") -> dict:
@@ -168,10 +212,53 @@ class AuraLogicClient:
             "virtual_inventory_id": virtual_inventory_id,
         })
 
+    # -- 批量迁移 --
+    def migrate_goods_bulk(self, data: dict) -> dict:
+        """一次请求完成 创建虚拟库存 + 导入卡密 + 绑定商品"""
+        return self._request("POST", "/migrations/goods-bulk", json=data)
+
     # -- 优惠码 -> 促销码 --
     def create_promo_code(self, data: dict) -> dict:
         return self._request("POST", "/promo-codes", json=data)
 
+    async def create_promo_codes_async(self, payloads: list[dict], concurrency: int) -> list:
+        """使用 aiohttp 并发创建促销码，返回与 payloads 一一对应的响应或异常"""
+        url = f"{self._api_base}/promo-codes"
+        sem = asyncio.Semaphore(concurrency)
+
+        async def post(session, payload: dict) -> dict:
+            async with sem:
+                # retry_count 为总尝试次数，与同步路径一致
+                attempts = max(1, self.config.retry_count)
+                for attempt in range(attempts):
+                    retryable = attempt < attempts - 1
+                    try:
+                        async with session.post(url, data=orjson.dumps(payload), headers=self._json_headers) as resp:
+                            if resp.status in RETRY_STATUSES and retryable:
+                                delay = self.config.retry_delay * (2 ** attempt)
+                                # 与同步路径一致，优先遵循服务端给出的 Retry-After (秒)
+                                retry_after = resp.headers.get("Retry-After")
+                                if retry_after:
+                                    try:
+                                        delay = max(0.0, float(retry_after))
+                                    except ValueError:
+                                        pass
+                                await asyncio.sleep(delay)
+                                continue
+                            resp.raise_for_status()
+                            body = await resp.read()
+                            return orjson.loads(body) if body else {}
+                    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                        if not retryable:
+                            raise
+                        await asyncio.sleep(self.config.retry_delay * (2 ** attempt))
+
+        # 连接数不小于并发数，避免请求排队等待连接时消耗超时时间
+        connector = aiohttp.TCPConnector(limit=max(32, concurrency), keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(total=self.config.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            return await asyncio.gather(*(post(session, p) for p in payloads), return_exceptions=True)
+
     def test_connection(self) -> bool:
         try:
             self._request("GET", "/products", params={"page": 1, "page_size": 1})
@@ -185,15 +272,43 @@ class AuraLogicClient:
 # 独角数卡数据库读取
 # ============================================================
 
+# 商品查询字段: (字段名, SQL 表达式)，NULL 默认值统一在 SQL 中处理
+GOODS_COLUMNS = (
+    ("id", "g.id"),
+    ("group_id", "g.group_id"),
+    ("gd_name", "g.gd_name"),
+    ("gd_description", "IFNULL(g.gd_description, '')"),
+    ("gd_keywords", "IFNULL(g.gd_keywords, '')"),
+    ("description", "IFNULL(g.description, '')"),
+    ("picture", "IFNULL(g.picture, '')"),
+    ("actual_price", "IFNULL(g.actual_price, 0)"),
+    ("retail_price", "IFNULL(g.retail_price, 0)"),
+    ("in_stock", "IFNULL(g.in_stock, 0)"),
+    ("ord", "IFNULL(g.ord, 1)"),
+    ("type", "g.type"),
+    ("is_open", "IFNULL(g.is_open, 1)"),
+    ("buy_limit_num", "IFNULL(g.buy_limit_num, 0)"),
+    ("buy_prompt", "IFNULL(g.buy_prompt, '')"),
+    ("wholesale_price_cnf", "IFNULL(g.wholesale_price_cnf, '')"),
+    ("other_ipu_cnf", "IFNULL(g.other_ipu_cnf, '')"),
+    ("api_hook", "IFNULL(g.api_hook, '')"),
+)
+Goods = namedtuple("Goods", [name for name, _ in GOODS_COLUMNS])
+
+
 class DujiaokaReader:
     """从独角数卡 MySQL 数据库读取数据"""
 
     def __init__(self, config: DujiaokaConfig):
         self.config = config
         self.conn = None
+        # pymysql 连接不是线程安全的，工作线程各自持有独立连接
+        self._local = threading.local()
+        self._thread_conns = []
+        self._thread_conns_lock = threading.Lock()
 
-    def connect(self):
-        self.conn = pymysql.connect(
+    def _open(self):
+        return pymysql.connect(
             host=self.config.host,
             port=self.config.port,
             user=self.config.user,
@@ -201,15 +316,36 @@ class DujiaokaReader:
             database=self.config.database,
             charset=self.config.charset,
             cursorclass=pymysql.cursors.DictCursor,
+            # 流式读取卡密期间会穿插 HTTP 导入，放宽服务端写超时避免游标被断开
+            init_command="SET SESSION net_write_timeout = 600",
         )
+
+    def connect(self):
+        self.conn = self._open()
         log.info(f"Connected to dujiaoka database at {self.config.host}:{self.config.port}")
 
     def close(self):
+        with self._thread_conns_lock:
+            for conn in self._thread_conns:
+                conn.close()
+            self._thread_conns.clear()
         if self.conn:
             self.conn.close()
 
+    def _get_conn(self):
+        """主线程使用 self.conn，其他线程按需建立独立连接"""
+        if threading.current_thread() is threading.main_thread():
+            return self.conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._thread_conns_lock:
+                self._thread_conns.append(conn)
+        return conn
+
     def _query(self, sql: str, params=None) -> list[dict]:
-        with self.conn.cursor() as cur:
+        with self._get_conn().cursor() as cur:
             cur.execute(sql, params)
             return cur.fetchall()
 
@@ -220,53 +356,63 @@ class DujiaokaReader:
         sql += " ORDER BY ord DESC, id ASC"
         return self._query(sql)
 
-    def get_goods(self, skip_disabled: bool = False) -> list[dict]:
-        sql = """
-            SELECT g.*, gg.gp_name AS category_name,
-                   IFNULL(gg.is_open, 1) AS category_is_open
+    def get_category_index(self) -> list[dict]:
+        """读取全部分类 (含已软删除)，与商品 LEFT JOIN 分类表的匹配范围一致"""
+        return self._query("SELECT id, gp_name, is_open FROM goods_group")
+
+    def get_goods(self, skip_disabled: bool = False) -> list[Goods]:
+        columns = ", ".join(f"{expr} AS {name}" for name, expr in GOODS_COLUMNS)
+        sql = f"""
+            SELECT {columns}
             FROM goods g
-            LEFT JOIN goods_group gg ON g.group_id = gg.id
             WHERE g.deleted_at IS NULL
         """
         if skip_disabled:
             sql += " AND g.is_open = 1"
         sql += " ORDER BY g.ord DESC, g.id ASC"
-        return self._query(sql)
+        # 以元组游标读取，直接构造 namedtuple，避免逐行字典查找
+        with self._get_conn().cursor(pymysql.cursors.Cursor) as cur:
+            cur.execute(sql)
+            return [Goods._make(row) for row in cur.fetchall()]
 
-    def get_carmis_by_goods(self, goods_id: int, only_unsold: bool = True) -> list[dict]:
+    def iter_carmis_by_goods(self, goods_id: int, only_unsold: bool = True, batch_size: int = 1000):
+        """使用服务端游标流式读取卡密，避免一次性载入全部行"""
         sql = "SELECT * FROM carmis WHERE goods_id = %s AND deleted_at IS NULL"
         if only_unsold:
             sql += " AND status = 1"
         sql += " ORDER BY id ASC"
-        return self._query(sql, (goods_id,))
-
-    def get_carmis_count(self, goods_id: int, only_unsold: bool = True) -> int:
-        sql = "SELECT COUNT(*) AS cnt FROM carmis WHERE goods_id = %s AND deleted_at IS NULL"
+        with self._get_conn().cursor(pymysql.cursors.SSDictCursor) as cur:
+            cur.execute(sql, (goods_id,))
+            while rows := cur.fetchmany(batch_size):
+                yield from rows
+
+    def get_carmis_counts(self, only_unsold: bool = True) -> dict[int, int]:
+        """一次查询返回所有商品的卡密数量: goods_id -> count"""
+        sql = "SELECT goods_id, COUNT(*) AS cnt FROM carmis WHERE deleted_at IS NULL"
         if only_unsold:
             sql += " AND status = 1"
-        rows = self._query(sql, (goods_id,))
-        return rows[0]["cnt"] if rows else 0
+        sql += " GROUP BY goods_id"
+        return {r["goods_id"]: r["cnt"] for r in self._query(sql)}
 
     def get_coupons(self) -> list[dict]:
         sql = "SELECT * FROM coupons WHERE deleted_at IS NULL ORDER BY id ASC"
         return self._query(sql)
 
-    def get_coupon_goods(self, coupon_id: int) -> list[int]:
-        sql = "SELECT goods_id FROM coupons_goods WHERE coupons_id = %s"
-        rows = self._query(sql, (coupon_id,))
-        return [r["goods_id"] for r in rows]
+    def get_coupon_goods_map(self) -> dict[int, list[int]]:
+        """一次查询返回所有优惠码关联的商品: coupons_id -> [goods_id]"""
+        coupon_goods: dict[int, list[int]] = {}
+        for r in self._query("SELECT coupons_id, goods_id FROM coupons_goods"):
+            coupon_goods.setdefault(r["coupons_id"], []).append(r["goods_id"])
+        return coupon_goods
 
     def get_summary(self) -> dict:
-        cats = self._query("SELECT COUNT(*) AS c FROM goods_group WHERE deleted_at IS NULL")
-        goods = self._query("SELECT COUNT(*) AS c FROM goods WHERE deleted_at IS NULL")
-        carmis = self._query("SELECT COUNT(*) AS c FROM carmis WHERE deleted_at IS NULL AND status = 1")
-        coupons = self._query("SELECT COUNT(*) AS c FROM coupons WHERE deleted_at IS NULL")
-        return {
-            "categories": cats[0]["c"],
-            "goods": goods[0]["c"],
-            "unsold_carmis": carmis[0]["c"],
-            "coupons": coupons[0]["c"],
-        }
+        return self._query("""
+            SELECT
+                (SELECT COUNT(*) FROM goods_group WHERE deleted_at IS NULL) AS categories,
+                (SELECT COUNT(*) FROM goods WHERE deleted_at IS NULL) AS goods,
+                (SELECT COUNT(*) FROM carmis WHERE deleted_at IS NULL AND status = 1) AS unsold_carmis,
+                (SELECT COUNT(*) FROM coupons WHERE deleted_at IS NULL) AS coupons
+        """)[0]
 
 
 # ============================================================
@@ -289,6 +435,16 @@ class MigrationEngine:
         self.product_map: dict[int, int] = {}
         # 映射表: dujiaoka goods_id -> auralogic virtual_inventory_id
         self.vinv_map: dict[int, int] = {}
+        # 保护并发写入 stats / vinv_map
+        self._lock = threading.Lock()
+        # 服务端返回 404 后置为 False，后续商品走逐步迁移
+        self._server_bulk = options.server_bulk
+        # 服务端不支持创建即预留时置为 False，循环卡密回退为 创建 + 预留 两次请求
+        self._reserved_create = True
+        # 分类索引: group_id -> 名称 / 是否启用，代替在商品查询中 JOIN 分类表
+        self._cat_name: dict[int, str] = {}
+        self._cat_open: dict[int, bool] = {}
+        self._load_categories_index()
         # 统计
         self.stats = {
             "products_created": 0,
@@ -296,64 +452,73 @@ class MigrationEngine:
             "products_failed": 0,
             "vinv_created": 0,
             "carmis_imported": 0,
+            "carmis_duplicated": 0,
             "bindings_created": 0,
             "coupons_created": 0,
             "coupons_failed": 0,
         }
 
-    def _build_product_payload(self, goods: dict) -> dict:
+    def _load_categories_index(self):
+        for cat in self.reader.get_category_index():
+            self._cat_name[cat["id"]] = cat["gp_name"] or "未分类"
+            self._cat_open[cat["id"]] = cat["is_open"] != 0
+
+    def _incr(self, key: str, n: int = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _build_product_payload(self, goods: Goods) -> dict:
         """将独角数卡商品转换为 AuraLogic 产品格式"""
-        is_virtual = goods["type"] == 1  # 1=自动发货(虚拟), 2=人工处理(实体)
+        is_virtual = goods.type == 1  # 1=自动发货(虚拟), 2=人工处理(实体)
 
         # is_open=0 或所属分类 is_open=0 → 强制 inactive
-        if goods.get("is_open", 1) == 0 or goods.get("category_is_open", 1) == 0:
+        if goods.is_open == 0 or not self._cat_open.get(goods.group_id, True):
             status = "inactive"
         else:
             status = self.opts.default_product_status
 
         payload = {
-            "sku": f"djk-{goods['id']}",
-            "name": goods["gd_name"],
+            "sku": f"djk-{goods.id}",
+            "name": goods.gd_name,
             "product_type": "virtual" if is_virtual else "physical",
-            "short_description": goods.get("gd_description", ""),
-            "description": goods.get("description", ""),
-            "category": goods.get("category_name", "未分类"),
-            "tags": [t.strip() for t in (goods.get("gd_keywords") or "").split(",") if t.strip()],
-            "price": float(goods.get("actual_price", 0)),
-            "original_price": float(goods.get("retail_price", 0)),
-            "stock": int(goods.get("in_stock", 0)),
-            "sort_order": int(goods.get("ord", 1)),
+            "short_description": goods.gd_description,
+            "description": goods.description,
+            "category": self._cat_name.get(goods.group_id, "未分类"),
+            "tags": [t.strip() for t in goods.gd_keywords.split(",") if t.strip()],
+            "price": float(goods.actual_price),
+            "original_price": float(goods.retail_price),
+            "stock": goods.in_stock,
+            "sort_order": goods.ord,
             "status": status,
             "auto_delivery": is_virtual,
         }
 
-        if goods.get("buy_limit_num", 0) > 0:
-            payload["max_purchase_limit"] = goods["buy_limit_num"]
+        if goods.buy_limit_num > 0:
+            payload["max_purchase_limit"] = goods.buy_limit_num
 
         # 商品图片
-        if goods.get("picture"):
+        if goods.picture:
             try:
-                pics = json.loads(goods["picture"]) if isinstance(goods["picture"], str) else goods["picture"]
+                pics = orjson.loads(goods.picture)
                 if isinstance(pics, list):
                     payload["images"] = [
                         {"url": p, "is_primary": i == 0} for i, p in enumerate(pics) if p
                     ]
                 elif isinstance(pics, str) and pics:
                     payload["images"] = [{"url": pics, "is_primary": True}]
-            except (json.JSONDecodeError, TypeError):
-                if goods["picture"]:
-                    payload["images"] = [{"url": goods["picture"], "is_primary": True}]
+            except (orjson.JSONDecodeError, TypeError):
+                payload["images"] = [{"url": goods.picture, "is_primary": True}]
 
         # 构建备注：购买提示 + 批发价配置 + 自定义输入框 + API Hook
         remark_parts = []
-        if goods.get("buy_prompt"):
-            remark_parts.append(f"[购买提示] {goods['buy_prompt']}")
-        if goods.get("wholesale_price_cnf"):
-            remark_parts.append(f"[批发价配置] {goods['wholesale_price_cnf']}")
-        if goods.get("other_ipu_cnf"):
-            remark_parts.append(f"[自定义输入框] {goods['other_ipu_cnf']}")
-        if goods.get("api_hook"):
-            remark_parts.append(f"[API Hook] {goods['api_hook']}")
+        if goods.buy_prompt:
+            remark_parts.append(f"[购买提示] {goods.buy_prompt}")
+        if goods.wholesale_price_cnf:
+            remark_parts.append(f"[批发价配置] {goods.wholesale_price_cnf}")
+        if goods.other_ipu_cnf:
+            remark_parts.append(f"[自定义输入框] {goods.other_ipu_cnf}")
+        if goods.api_hook:
+            remark_parts.append(f"[API Hook] {goods.api_hook}")
         if remark_parts:
             payload["remark"] = "\n".join(remark_parts)
 
@@ -371,13 +536,14 @@ class MigrationEngine:
         with Progress(
             SpinnerColumn(), TextColumn("[progress.description]{task.description}"),
             BarColumn(), TextColumn("{task.completed}/{task.total}"),
-            console=console,
+            # update()/advance() 只更新状态，终端输出由刷新线程按 refresh_per_second 统一完成
+            console=console, refresh_per_second=4, transient=False,
         ) as progress:
             task = progress.add_task("Migrating products...", total=len(goods_list))
 
             for goods in goods_list:
-                gid = goods["id"]
-                name = goods["gd_name"]
+                gid = goods.id
+                name = goods.gd_name
                 progress.update(task, description=f"Product: {name[:30]}")
 
                 try:
@@ -409,9 +575,10 @@ class MigrationEngine:
             log.warning("No products mapped, skipping carmis migration")
             return
 
+        carmis_counts = self.reader.get_carmis_counts()
         goods_with_carmis = [
-            (gid, pid) for gid, pid in self.product_map.items()
-            if self.reader.get_carmis_count(gid) > 0
+            (gid, pid, carmis_counts[gid]) for gid, pid in self.product_map.items()
+            if carmis_counts.get(gid, 0) > 0
         ]
 
         if not goods_with_carmis:
@@ -423,24 +590,32 @@ class MigrationEngine:
         with Progress(
             SpinnerColumn(), TextColumn("[progress.description]{task.description}"),
             BarColumn(), TextColumn("{task.completed}/{task.total}"),
-            console=console,
+            # update()/advance() 只更新状态，终端输出由刷新线程按 refresh_per_second 统一完成
+            console=console, refresh_per_second=4, transient=False,
         ) as progress:
             task = progress.add_task("Migrating carmis...", total=len(goods_with_carmis))
 
-            for gid, pid in goods_with_carmis:
-                progress.update(task, description=f"Carmis for djk-{gid}")
-                try:
-                    self._migrate_carmis_for_goods(gid, pid)
-                except Exception as e:
-                    log.error(f"Failed to migrate carmis for djk-{gid}: {e}")
-                progress.advance(task)
+            # 商品迁移阶段只用一个连接，在启动线程池前再预热，避免空闲连接已被服务端关闭
+            if not self.opts.dry_run and self.opts.workers > 1:
+                self._warm_up_connections()
 
-    def _migrate_carmis_for_goods(self, goods_id: int, product_id: int):
+            # 每个商品的卡密迁移都是多次阻塞 HTTP 调用，用线程池并发处理
+            with ThreadPoolExecutor(max_workers=self.opts.workers) as executor:
+                futures = {
+                    executor.submit(self._migrate_carmis_for_goods, gid, pid, count): gid
+                    for gid, pid, count in goods_with_carmis
+                }
+                for future in as_completed(futures):
+                    gid = futures[future]
+                    progress.update(task, description=f"Carmis for djk-{gid}")
+                    try:
+                        future.result()
+                    except Exception as e:
+                        log.error(f"Failed to migrate carmis for djk-{gid}: {e}")
+                    progress.advance(task)
+
+    def _migrate_carmis_for_goods(self, goods_id: int, product_id: int, carmis_count: int):
         """为单个商品迁移卡密"""
-        carmis = self.reader.get_carmis_by_goods(goods_id)
-        if not carmis:
-            return
-
         # 1. 创建虚拟库存
         vinv_data = {
             "name": f"djk-{goods_id} 卡密库存",
@@ -450,45 +625,54 @@ class MigrationEngine:
         }
 
         if self.opts.dry_run:
-            log.info(f"[DRY RUN] Would create virtual inventory for djk-{goods_id} ({len(carmis)} items)")
-            self.vinv_map[goods_id] = -1
-            self.stats["vinv_created"] += 1
-            self.stats["carmis_imported"] += len(carmis)
+            log.info(f"[DRY RUN] Would create virtual inventory for djk-{goods_id} ({carmis_count} items)")
+            with self._lock:
+                self.vinv_map[goods_id] = -1
+                self.stats["vinv_created"] += 1
+                self.stats["carmis_imported"] += carmis_count
             return
 
+        # 已读取的卡密: (普通卡密, 循环卡密)，批量接口不可用时复用，避免重复扫描和重复计数
+        prefetched = None
+        if self._server_bulk:
+            loop_items: list[str] = []
+            normal_items = list(self._iter_carmis(goods_id, loop_items))
+            if self._migrate_carmis_bulk(goods_id, product_id, vinv_data, normal_items, loop_items):
+                return
+            prefetched = (normal_items, loop_items)
+
         result = self.client.create_virtual_inventory(vinv_data)
         vinv_id = result.get("id") or result.get("data", {}).get("id")
         if not vinv_id:
             log.error(f"Virtual inventory created but no ID returned for djk-{goods_id}")
             return
 
-        self.vinv_map[goods_id] = vinv_id
-        self.stats["vinv_created"] += 1
+        with self._lock:
+            self.vinv_map[goods_id] = vinv_id
+            self.stats["vinv_created"] += 1
         log.info(f"Created virtual inventory: id={vinv_id} for djk-{goods_id}")
 
-        # 2. 导入卡密，区分普通卡密和循环卡密
-        normal_items = [c["carmi"] for c in carmis if c.get("carmi") and not c.get("is_loop")]
-        loop_items = [c for c in carmis if c.get("carmi") and c.get("is_loop")]
-
-        # 2a. 普通卡密批量导入
-        for i in range(0, len(normal_items), self.opts.batch_size):
-            batch = normal_items[i:i + self.opts.batch_size]
-            try:
-                self.client.import_virtual_stock(vinv_id, batch)
-                self.stats["carmis_imported"] += len(batch)
-            except Exception as e:
-                log.error(f"Failed to import batch {i // self.opts.batch_size + 1} for vinv {vinv_id}: {e}")
+        # 2. 流式读取卡密，区分普通卡密和循环卡密
+        # 2a. 普通卡密攒够 batch_size 条或 max_import_body_bytes 字节即批量导入，
+        #     不在内存中保留卡密内容，去重仅为每条不同卡密保留 16 字节摘要
+        if prefetched:
+            normal_items, loop_items = prefetched
+        else:
+            loop_items = []
+            normal_items = self._iter_carmis(goods_id, loop_items)
+        batches = chunked(
+            normal_items,
+            self.opts.batch_size,
+            self.opts.max_import_body_bytes,
+        )
+        for batch_no, batch in enumerate(batches, 1):
+            self._import_carmi_batch(vinv_id, batch, batch_no)
 
-        # 2b. 循环卡密逐条导入，创建后标记为已预留
-        for c in loop_items:
+        # 2b. 循环卡密逐条导入并标记为已预留
+        for carmi in loop_items:
             try:
-                result = self.client.create_virtual_stock_item(
-                    vinv_id, c["carmi"], remark="[循环卡密] 可重复使用"
-                )
-                stock_id = result.get("stock", {}).get("id")
-                if stock_id:
-                    self.client.reserve_stock_item(vinv_id, stock_id, remark="循环卡密-已预留")
-                self.stats["carmis_imported"] += 1
+                self._create_loop_stock_item(vinv_id, carmi)
+                self._incr("carmis_imported")
             except Exception as e:
                 log.error(f"Failed to import loop carmi for vinv {vinv_id}: {e}")
 
@@ -499,11 +683,109 @@ class MigrationEngine:
         if product_id > 0:
             try:
                 self.client.bind_virtual_inventory(product_id, vinv_id)
-                self.stats["bindings_created"] += 1
+                self._incr("bindings_created")
                 log.info(f"Bound virtual inventory {vinv_id} to product {product_id}")
             except Exception as e:
                 log.error(f"Failed to bind vinv {vinv_id} to product {product_id}: {e}")
 
+    def _migrate_carmis_bulk(self, goods_id: int, product_id: int, vinv_data: dict,
+                             normal_items: list[str], loop_items: list[str]) -> bool:
+        """通过服务端批量迁移接口一次完成单个商品的卡密迁移，接口不存在时返回 False"""
+        payload = {
+            "virtual_inventory": vinv_data,
+            "items": normal_items,
+            "loop_items": loop_items,
+        }
+        if product_id > 0:
+            payload["bind_product_id"] = product_id
+
+        # 请求体超过上限时 (如反向代理 client_max_body_size) 该商品改走逐步迁移
+        if len(orjson.dumps(payload)) > self.opts.max_import_body_bytes:
+            log.info(f"Bulk payload for djk-{goods_id} exceeds size limit, using per-step migration")
+            return False
+
+        try:
+            result = self.client.migrate_goods_bulk(payload)
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status == 404:
+                with self._lock:
+                    if self._server_bulk:
+                        self._server_bulk = False
+                        log.warning("Bulk migration endpoint not available, falling back to per-step migration")
+                return False
+            if status == 413:
+                log.warning(f"Bulk payload for djk-{goods_id} rejected as too large, using per-step migration")
+                return False
+            raise
+
+        data = result.get("data") or result
+        vinv_id = data.get("virtual_inventory_id")
+        if not vinv_id:
+            log.error(f"Bulk migration returned no virtual inventory ID for djk-{goods_id}")
+            return True
+
+        with self._lock:
+            self.vinv_map[goods_id] = vinv_id
+            self.stats["vinv_created"] += 1
+            self.stats["carmis_imported"] += len(normal_items) + len(loop_items)
+            if product_id > 0:
+                self.stats["bindings_created"] += 1
+        log.info(f"Bulk migrated {len(normal_items) + len(loop_items)} carmis for djk-{goods_id} -> vinv {vinv_id}")
+        return True
+
+    def _iter_carmis(self, goods_id: int, loop_items: list[str]):
+        """逐条产出去重后的普通卡密内容，循环卡密收集到 loop_items 中"""
+        # 仅保存定长摘要，去重内存与卡密长度无关
+        seen: set[bytes] = set()
+        for c in self.reader.iter_carmis_by_goods(goods_id):
+            carmi = c.get("carmi")
+            if not carmi:
+                continue
+            if c.get("is_loop"):
+                loop_items.append(carmi)
+            else:
+                digest = hashlib.blake2b(carmi.encode("utf-8"), digest_size=16).digest()
+                if digest in seen:
+                    self._incr("carmis_duplicated")
+                    continue
+                seen.add(digest)
+                yield carmi
+
+    def _create_loop_stock_item(self, vinv_id: int, carmi: str):
+        """创建循环卡密库存项，优先一次请求创建为已预留，服务端不支持时回退为创建后预留"""
+        remark = "[循环卡密] 可重复使用"
+        result = None
+        if self._reserved_create:
+            try:
+                result = self.client.create_virtual_stock_item(vinv_id, carmi, remark=remark, reserved=True)
+            except requests.exceptions.HTTPError as e:
+                if e.response is None or e.response.status_code != 400:
+                    raise
+                self._disable_reserved_create()
+        if result is None:
+            result = self.client.create_virtual_stock_item(vinv_id, carmi, remark=remark)
+
+        stock = result.get("stock") or result.get("data", {}).get("stock") or {}
+        if stock.get("id") and stock.get("status") != "reserved":
+            # 服务端忽略了 initial_status，之后不再携带该字段
+            if self._reserved_create:
+                self._disable_reserved_create()
+            self.client.reserve_stock_item(vinv_id, stock["id"], remark="循环卡密-已预留")
+
+    def _disable_reserved_create(self):
+        with self._lock:
+            if self._reserved_create:
+                self._reserved_create = False
+                log.warning("Server does not support creating reserved stock items, falling back to create + reserve")
+
+    def _import_carmi_batch(self, vinv_id: int, batch: list[str], batch_no: int):
+        try:
+            self.client.import_virtual_stock(vinv_id, batch)
+            self._incr("carmis_imported", len(batch))
+        except Exception as e:
+            log.error(f"Failed to import batch {batch_no} for vinv {vinv_id}: {e}")
+
     def migrate_coupons(self):
         """迁移优惠码 -> AuraLogic 促销码"""
         coupons = self.reader.get_coupons()
@@ -513,18 +795,19 @@ class MigrationEngine:
 
         log.info(f"Found {len(coupons)} coupons to migrate")
 
+        coupon_goods = self.reader.get_coupon_goods_map()
+        # 仅保留已实际创建的商品映射 (dry run 下为 -1)
+        valid_map = {k: v for k, v in self.product_map.items() if v > 0}
+
+        # 先同步构建全部请求体，再统一提交
+        pending: list[tuple[int, str, dict]] = []
         for coupon in coupons:
             cid = coupon["id"]
             code = coupon["coupon"]
 
             try:
                 # 查找关联商品
-                djk_goods_ids = self.reader.get_coupon_goods(cid)
-                al_product_ids = [
-                    self.product_map[gid]
-                    for gid in djk_goods_ids
-                    if gid in self.product_map and self.product_map[gid] > 0
-                ]
+                al_product_ids = [valid_map[g] for g in coupon_goods.get(cid, ()) if g in valid_map]
 
                 payload = {
                     "code": code,
@@ -547,14 +830,47 @@ class MigrationEngine:
                     log.info(f"[DRY RUN] Would create promo code: {code} (discount={payload['discount_value']})")
                     self.stats["coupons_created"] += 1
                 else:
-                    self.client.create_promo_code(payload)
-                    self.stats["coupons_created"] += 1
-                    log.info(f"Created promo code: {code}")
+                    pending.append((cid, code, payload))
 
             except Exception as e:
                 log.error(f"Failed to create promo code '{code}' (djk-{cid}): {e}")
                 self.stats["coupons_failed"] += 1
 
+        if not pending:
+            return
+
+        # 优惠码之间没有依赖，安装了 aiohttp 且 workers > 1 时并发提交
+        if aiohttp is not None and self.opts.workers > 1:
+            results = asyncio.run(self.client.create_promo_codes_async(
+                [payload for _, _, payload in pending], self.opts.workers,
+            ))
+        else:
+            results = []
+            for _, _, payload in pending:
+                try:
+                    results.append(self.client.create_promo_code(payload))
+                except Exception as e:
+                    results.append(e)
+
+        for (cid, code, _), result in zip(pending, results):
+            if isinstance(result, BaseException):
+                log.error(f"Failed to create promo code '{code}' (djk-{cid}): {result}")
+                self.stats["coupons_failed"] += 1
+            else:
+                self.stats["coupons_created"] += 1
+                log.info(f"Created promo code: {code}")
+
+    def _warm_up_connections(self):
+        """并发发起轻量请求，为每个卡密迁移线程预先建立 keep-alive 连接"""
+        def probe(_):
+            self.client.list_products(page=1, page_size=1)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.opts.workers) as executor:
+                list(executor.map(probe, range(self.opts.workers)))
+        except Exception as e:
+            log.warning(f"Connection pool warm-up failed: {e}")
+
     def run(self):
         """执行完整迁移流程"""
         console.rule("[bold blue]开始迁移 独角数卡 -> AuraLogic")
@@ -606,6 +922,7 @@ class MigrationEngine:
         table.add_row("商品创建失败", str(self.stats["products_failed"]))
         table.add_row("虚拟库存创建", str(self.stats["vinv_created"]))
         table.add_row("卡密导入", str(self.stats["carmis_imported"]))
+        table.add_row("重复卡密跳过", str(self.stats["carmis_duplicated"]))
         table.add_row("库存绑定", str(self.stats["bindings_created"]))
         table.add_row("优惠码创建成功", str(self.stats["coupons_created"]))
         table.add_row("优惠码创建失败", str(self.stats["coupons_failed"]))
@@ -613,12 +930,13 @@ class MigrationEngine:
 
         # 导出映射表供后续使用
         mapping = {
-            "product_map": {str(k): v for k, v in self.product_map.items()},
-            "virtual_inventory_map": {str(k): v for k, v in self.vinv_map.items()},
+            "product_map": self.product_map,
+            "virtual_inventory_map": self.vinv_map,
         }
         mapping_file = "migration_mapping.json"
-        with open(mapping_file, "w", encoding="utf-8") as f:
-            json.dump(mapping, f, indent=2, ensure_ascii=False)
+        # OPT_NON_STR_KEYS 直接将 int 键序列化为字符串键
+        with open(mapping_file, "wb") as f:
+            f.write(orjson.dumps(mapping, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         console.print(f"\nID 映射表已保存到: [bold]{mapping_file}[/bold]")
 
 
@@ -670,7 +988,13 @@ def build_parser() -> argparse.ArgumentParser:
     opts.add_argument("--no-carmis", action="store_true", help="跳过卡密迁移")
     opts.add_argument("--no-coupons", action="store_true", help="跳过优惠码迁移")
     opts.add_argument("--skip-disabled", action="store_true", help="跳过已禁用的商品和分类")
-    opts.add_argument("--batch-size", type=int, default=50, help="卡密批量导入大小 (default: 50)")
+    opts.add_argument("--batch-size", type=int, default=2000, help="卡密批量导入大小 (default: 2000)")
+    opts.add_argument("--max-import-body-bytes", type=int, default=8 * 1024 * 1024,
+                       help="单次卡密导入请求体 (表单编码后) 的字节上限 (default: 8388608, 即 8 MiB)")
+    opts.add_argument("--workers", type=int, default=4,
+                       help="卡密/优惠码迁移并发数，1 表示串行 (default: 4)")
+    opts.add_argument("--server-bulk", action="store_true",
+                       help="使用服务端批量迁移接口，每个商品的卡密迁移只需一次请求 (服务端不支持时自动回退)")
     opts.add_argument("--product-status", default="draft",
                        choices=["draft", "active", "inactive"],
                        help="导入商品的初始状态 (default: draft)")
@@ -681,6 +1005,12 @@ def build_parser() -> argparse.ArgumentParser:
 def main():
     parser = build_parser()
     args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size 必须大于 0")
+    if args.workers < 1:
+        parser.error("--workers 必须大于 0")
+    if args.max_import_body_bytes < 1:
+        parser.error("--max-import-body-bytes 必须大于 0")
 
     # 构建配置
     db_config = DujiaokaConfig(
@@ -695,6 +1025,7 @@ def main():
         base_url=args.api_url,
         api_key=args.api_key,
         api_secret=args.api_secret,
+        pool_maxsize=max(32, args.workers),
     )
 
     migration_opts = MigrationOptions(
@@ -703,6 +1034,9 @@ def main():
         migrate_coupons=not args.no_coupons,
         dry_run=args.dry_run,
         batch_size=args.batch_size,
+        max_import_body_bytes=args.max_import_body_bytes,
+        workers=args.workers,
+        server_bulk=args.server_bulk,
         skip_disabled=args.skip_disabled,
         default_product_status=args.product_status,
     )